@@ -1,5 +1,13 @@
+import argparse
+import itertools
+import json
 import os
-import nbformat as nbf
+import queue
+import re
+import sys
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 # Define the path where your Markdown files are located
 md_files_path = './'  # Adjust this path if your files are in a different directory
@@ -32,67 +40,161 @@ output_dir = 'notebooks'
 # Create the output directory if it doesn't exist
 os.makedirs(output_dir, exist_ok=True)
 
+# Fenced code block: opening fence with optional language, body, closing fence.
+# The body is consumed a whole line at a time, so the closing fence is only
+# tried at line starts instead of at every character.
+FENCE = re.compile(r"^[ \t]*```([^\n]*)\n((?:[^\n]*\n)*?)[ \t]*```[^\n]*$\n?", re.M)
+
+# Build cells as plain dicts in the nbformat v4 shape. They are well-formed by
+# construction, so no schema validation is run on them
+def new_markdown_cell(source):
+    return {"cell_type": "markdown", "id": uuid.uuid4().hex[:8], "metadata": {}, "source": source}
+
+def new_code_cell(source, metadata=None):
+    return {
+        "cell_type": "code",
+        "execution_count": None,
+        "id": uuid.uuid4().hex[:8],
+        "metadata": metadata or {},
+        "outputs": [],
+        "source": source,
+    }
+
 # Function to split the content into markdown and code cells
 def split_content_to_cells(md_content):
-    lines = md_content.splitlines()
     cells = []
-    in_code_block = False
-    code_block = []
-    markdown_block = []
-    current_code_type = "python"
-
-    for line in lines:
-        if line.strip().startswith("```"):  # Detect start or end of a code block
-            if in_code_block:
-                # End of code block
-                if current_code_type == "python":
-                    cells.append(nbf.v4.new_code_cell("\n".join(code_block)))
-                else:
-                    cells.append(nbf.v4.new_code_cell("\n".join(code_block), metadata={"kernelspec": {"name": "bash"}}))
-                code_block = []
-            else:
-                # End of markdown block
-                if markdown_block:
-                    cells.append(nbf.v4.new_markdown_cell("\n".join(markdown_block)))
-                    markdown_block = []
-                current_code_type = line.strip()[3:]  # Get the language type
-            in_code_block = not in_code_block
-        elif in_code_block:
-            code_block.append(line)
+    last_end = 0
+
+    # Slice each cell's source straight out of md_content, dropping the newline
+    # that ends the block, so every cell costs one string allocation
+    for match in FENCE.finditer(md_content):
+        # Markdown between the previous code block and this one
+        if match.start() > last_end:
+            cells.append(new_markdown_cell(md_content[last_end:match.start() - 1]))
+
+        code_block = md_content[match.start(2):match.end(2) - 1]
+        if match.group(1).strip() == "python":
+            cells.append(new_code_cell(code_block))
         else:
-            markdown_block.append(line)
+            cells.append(new_code_cell(code_block, metadata={"kernelspec": {"name": "bash"}}))
+        last_end = match.end()
 
-    # Add any remaining content as a markdown cell
-    if markdown_block:
-        cells.append(nbf.v4.new_markdown_cell("\n".join(markdown_block)))
+    # Add any remaining content as a markdown cell. An unclosed fence never
+    # matches FENCE, so its text, opening fence line included, ends up here
+    if last_end < len(md_content):
+        end = len(md_content) - 1 if md_content.endswith("\n") else len(md_content)
+        cells.append(new_markdown_cell(md_content[last_end:end]))
 
     return cells
 
-# Loop through each Markdown file and convert it to a Jupyter Notebook
-for md_file in md_files:
-    # Define the output notebook filename
-    notebook_filename = os.path.join(output_dir, os.path.splitext(md_file)[0] + '.ipynb')
-    
-    # Read the content of the markdown file
-    with open(os.path.join(md_files_path, md_file), 'r') as f:
-        md_content = f.read()
-
-    # Create a new Jupyter notebook
-    nb = nbf.v4.new_notebook()
+# Read a Markdown file and return its content
+def read_markdown(in_path):
+    with open(in_path, 'r', encoding='utf-8') as f:
+        return f.read()
 
+# Convert a single Markdown file's content to a Jupyter Notebook and return
+# its path together with the serialized notebook
+def convert_one(stem, notebook_filename, md_content):
     # Split content into notebook cells
-    nb.cells = split_content_to_cells(md_content)
+    cells = split_content_to_cells(md_content)
 
     # Check if the first line of content is an H1 header
-    if not nb.cells[0]['source'].startswith("# "):
+    if not cells[0]['source'].startswith("# "):
         # Add a dynamic title cell only if the first line is not an H1 header
-        title_cell = nbf.v4.new_markdown_cell(f"# {os.path.splitext(md_file)[0].replace('_', ' ').title()}")
-        nb.cells.insert(0, title_cell)
+        title_cell = new_markdown_cell(f"# {stem.replace('_', ' ').title()}")
+        cells.insert(0, title_cell)
+
+    # Store sources as lists of lines, like nbformat does on disk
+    for cell in cells:
+        cell['source'] = cell['source'].splitlines(True)
+
+    # Create a new Jupyter notebook
+    nb = {"cells": cells, "metadata": {}, "nbformat": 4, "nbformat_minor": 5}
+
+    # Serialize the notebook in memory with the same layout nbformat writes;
+    # the writer thread saves it with a single write
+    return notebook_filename, json.dumps(nb, sort_keys=True, indent=1, ensure_ascii=False) + "\n"
+
+# Save serialized notebooks from the queue until the None sentinel arrives,
+# recording (filename, error) pairs in failures for the main thread
+def writer_worker(write_queue, failures):
+    while True:
+        item = write_queue.get()
+        if item is None:
+            break
+        notebook_filename, notebook_text = item
+        # Write to a temporary file and move it into place, so an interrupted
+        # write never leaves a partial notebook that looks up to date.
+        # Catch everything so the thread keeps draining the queue and the
+        # producer never blocks forever on put()
+        temp_filename = notebook_filename + '.tmp'
+        try:
+            with open(temp_filename, 'w', encoding='utf-8') as f:
+                f.write(notebook_text)
+            os.replace(temp_filename, notebook_filename)
+        except Exception as e:
+            print(f"Failed to write {notebook_filename}: {e}")
+            failures.append((notebook_filename, e))
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            continue
+        print(f"Notebook created successfully: {notebook_filename}")
+
+# A notebook is up to date if it exists and is at least as new as its source
+def is_up_to_date(in_path, out_path):
+    return os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(in_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the Pydantic Markdown lessons to Jupyter notebooks.")
+    parser.add_argument('--force', action='store_true',
+                        help="regenerate every notebook, even if it is newer than its source")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="list the notebooks that would be regenerated without writing them")
+    args = parser.parse_args()
+
+    # Resolve every file's stem, input path and output notebook path once up front
+    stems = [os.path.splitext(md_file)[0] for md_file in md_files]
+    in_paths = [os.path.join(md_files_path, md_file) for md_file in md_files]
+    out_paths = [os.path.join(output_dir, stem + '.ipynb') for stem in stems]
+
+    # Skip notebooks that are already newer than their Markdown source
+    if not args.force:
+        stale = [not is_up_to_date(in_path, out_path) for in_path, out_path in zip(in_paths, out_paths)]
+        stems = list(itertools.compress(stems, stale))
+        in_paths = list(itertools.compress(in_paths, stale))
+        out_paths = list(itertools.compress(out_paths, stale))
+
+    if args.dry_run:
+        for out_path in out_paths:
+            print(f"Would create notebook: {out_path}")
+        print(f"{len(out_paths)} of {len(md_files)} notebooks would be (re)created.")
+        sys.exit(0)
+
+    if not out_paths:
+        print(f"All notebooks in the '{output_dir}' directory are up to date.")
+        sys.exit(0)
+
+    # Read all Markdown files up front; threads overlap the I/O latency on slow filesystems
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        md_contents = list(executor.map(read_markdown, in_paths))
+
+    # Write notebooks on a background thread so saving overlaps with conversion
+    write_queue = queue.Queue(maxsize=4)
+    failures = []
+    writer = threading.Thread(target=writer_worker, args=(write_queue, failures), daemon=True)
+    writer.start()
 
-    # Save the notebook
-    with open(notebook_filename, 'w') as f:
-        nbf.write(nb, f)
+    # Each file is independent, so convert them in parallel across cores
+    try:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            for result in executor.map(convert_one, stems, out_paths, md_contents):
+                write_queue.put(result)
+    finally:
+        write_queue.put(None)
+        writer.join()
 
-    print(f"Notebook created successfully: {notebook_filename}")
+    if failures:
+        print(f"{len(failures)} of {len(out_paths)} notebooks could not be written.")
+        sys.exit(1)
 
-print(f"All notebooks have been created and saved in the '{output_dir}' directory.")
+    print(f"All notebooks have been created and saved in the '{output_dir}' directory.")
@@ -1,17 +1,20 @@
+import argparse
+import functools
 import venv
 import subprocess
 import sys
 import os
+import re
 import platform
 import getpass
 import shutil
+import tempfile
 import logging
-import io
+import json
 import traceback
 
-# Set up logging
-log_stream = io.StringIO()
-logging.basicConfig(stream=log_stream, level=logging.DEBUG, 
+# Set up logging, written to disk as the script runs so nothing is lost on a crash
+logging.basicConfig(filename='setup_log.txt', filemode='w', level=logging.DEBUG, 
                     format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Try to import colorama, fall back to no colors if not available
@@ -55,10 +58,26 @@ def run_command(command, use_sudo=False):
     try:
         if use_sudo:
             command = ["sudo"] + command
-        result = subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        # Wait in short slices rather than blocking until the command exits, so
+        # Ctrl-C and other threads stay responsive. communicate() keeps draining
+        # the pipes, which avoids deadlocking on verbose commands like apt.
+        try:
+            while True:
+                try:
+                    stdout, stderr = proc.communicate(timeout=0.1)
+                    break
+                except subprocess.TimeoutExpired:
+                    continue
+        except KeyboardInterrupt:
+            proc.kill()
+            proc.wait()
+            raise
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, command, output=stdout, stderr=stderr)
         logging.info(f"Command executed: {' '.join(command)}")
-        logging.info(f"Command output: {result.stdout}")
-        return result.stdout
+        logging.info(f"Command output: {stdout}")
+        return stdout
     except subprocess.CalledProcessError as e:
         error_msg = f"Error executing command: {e}"
         print_color(error_msg, Fore.RED)
@@ -85,64 +104,127 @@ def install_python_venv(version):
         print_color(f"❌ Failed to install python{version}-venv package. Please install it manually.", Fore.RED)
         return False
 
+@functools.lru_cache(maxsize=1)
 def get_python_version():
     return f"{sys.version_info.major}.{sys.version_info.minor}"
 
-def install_requirements(python_path):
+def normalize_package_name(name):
+    # Compare names the way pip does: case-insensitive, with '-', '_' and '.' equivalent
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+# Prints the names of all distributions installed in the running interpreter
+LIST_PACKAGES_SCRIPT = (
+    "import importlib.metadata, json, sys; "
+    "sys.stdout.write(json.dumps([d.metadata['Name'] for d in importlib.metadata.distributions()]))"
+)
+
+def get_installed_packages(python_path):
+    # Ask the venv's interpreter directly instead of starting pip
+    result = subprocess.run([python_path, '-c', LIST_PACKAGES_SCRIPT],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if result.returncode != 0:
+        logging.error(f"Failed to list installed packages: {result.stderr}")
+        return set()
+    return {normalize_package_name(name) for name in json.loads(result.stdout) if name}
+
+# Downloads the wheels for requirements.txt in the background. The wheels go
+# into a private per-run directory (mkdtemp creates it with mode 0700) so nothing
+# another user planted is ever installed. This is best effort: if the host Python
+# has no pip, the download fails and the venv installs from PyPI as usual.
+class WheelPrefetch:
+    def __init__(self):
+        self.wheel_dir = tempfile.mkdtemp(prefix='learningllm-wheels-')
+        self.log_file = tempfile.TemporaryFile(mode='w+')
+        self.process = subprocess.Popen([sys.executable, '-m', 'pip', 'download', '--quiet',
+                                         '-r', 'requirements.txt', '-d', self.wheel_dir],
+                                        stdout=self.log_file, stderr=subprocess.STDOUT, text=True)
+
+    def wait(self):
+        # Return the wheel directory if the download succeeded, otherwise None
+        if self.process.wait() == 0:
+            logging.info(f"Prefetched requirements into {self.wheel_dir}")
+            return self.wheel_dir
+        self.log_file.seek(0)
+        logging.warning(f"Prefetching requirements failed: {self.log_file.read()}")
+        return None
+
+    def stop(self):
+        # Kill the download if it is still running and remove the downloaded wheels
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.log_file.close()
+        shutil.rmtree(self.wheel_dir, ignore_errors=True)
+
+def install_requirements(python_path, prefetch=None):
     print_color("Installing required packages:", Fore.CYAN)
     with open('requirements.txt', 'r') as f:
-        requirements = f.read().splitlines()
+        requirements = [line.strip() for line in f.read().splitlines() if line.strip()]
+
+    installed_packages = get_installed_packages(python_path)
 
+    missing = []
     for package in requirements:
-        try:
-            # Check if the package is already installed
-            result = subprocess.run([python_path, '-m', 'pip', 'show', package], 
+        # Only a bare name can be checked by name alone; lines with versions,
+        # extras or markers go to pip, which skips them if already satisfied
+        is_bare_name = re.fullmatch(r"[A-Za-z0-9][A-Za-z0-9._-]*", package) is not None
+        if is_bare_name and normalize_package_name(package) in installed_packages:
+            print_color(f"  ✅ {package} is already installed.", Fore.GREEN)
+        else:
+            missing.append(package)
+
+    if not missing:
+        return True
+
+    # Prefer wheels from the background download, but only if it succeeded
+    pip_install = [python_path, '-m', 'pip', 'install']
+    wheel_dir = prefetch.wait() if prefetch is not None else None
+    if wheel_dir is not None:
+        pip_install += ['--find-links', wheel_dir]
+
+    # Install everything that is missing in a single pip run
+    print_color(f"  Installing {', '.join(missing)}...", Fore.YELLOW)
+    install_result = subprocess.run([*pip_install, *missing], 
                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            if result.returncode == 0:
-                print_color(f"  ✅ {package} is already installed.", Fore.GREEN)
-            else:
-                # If not installed, attempt to install it
-                install_result = subprocess.run([python_path, '-m', 'pip', 'install', package], 
-                                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-                if install_result.returncode == 0:
-                    print_color(f"  ✅ Installed {package} successfully.", Fore.GREEN)
-                else:
-                    error_msg = f"  ❌ Failed to install {package}. Error: {install_result.stderr}"
-                    print_color(error_msg, Fore.RED)
-                    logging.error(error_msg)
-                    return False
-        except subprocess.CalledProcessError as e:
-            error_msg = f"  ❌ Error checking/installing {package}: {str(e)}"
+    if install_result.returncode == 0:
+        for package in missing:
+            print_color(f"  ✅ Installed {package} successfully.", Fore.GREEN)
+        return True
+
+    logging.error(f"Batch install failed: {install_result.stderr}")
+    print_color("  Batch install failed. Retrying packages individually...", Fore.YELLOW)
+
+    # Retry each package on its own so failures can be reported per package.
+    # The retries run one at a time: pip does not lock site-packages, and these
+    # packages share most of their dependencies.
+    success = True
+    for package in missing:
+        install_result = subprocess.run([*pip_install, package], 
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        if install_result.returncode == 0:
+            print_color(f"  ✅ Installed {package} successfully.", Fore.GREEN)
+        else:
+            error_msg = f"  ❌ Failed to install {package}. Error: {install_result.stderr}"
             print_color(error_msg, Fore.RED)
             logging.error(error_msg)
-            return False
-    return True
+            success = False
+    return success
 
-def setup_venv():
+def get_venv_python_version(python_path):
+    # Return the "major.minor" version of an existing venv interpreter, or None
+    if not os.path.exists(python_path):
+        return None
+    result = subprocess.run([python_path, '--version'],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    if result.returncode != 0:
+        return None
+    # Output looks like "Python 3.11.4"
+    return '.'.join(result.stdout.split()[-1].split('.')[:2])
+
+def setup_venv(force=False):
     venv_path = os.path.join(os.getcwd(), 'venv')
     python_version = get_python_version()
     
-    # Remove existing venv if it exists
-    if os.path.exists(venv_path):
-        print_color(f"Removing existing virtual environment at {venv_path}", Fore.YELLOW)
-        shutil.rmtree(venv_path)
-        print_color("✅ Existing virtual environment removed.", Fore.GREEN)
-    
-    if not is_venv_installed():
-        print_color("python3-venv is not installed. Attempting to install it...", Fore.YELLOW)
-        if not install_python_venv(python_version):
-            print_color("Failed to install python3-venv. Please install it manually and run this script again.", Fore.RED)
-            return False
-    
-    try:
-        venv.create(venv_path, with_pip=True)
-        print_color(f"✅ Virtual environment created at {venv_path}", Fore.GREEN)
-    except subprocess.CalledProcessError as e:
-        error_msg = f"❌ Virtual environment creation failed: {str(e)}"
-        print_color(error_msg, Fore.RED)
-        logging.error(error_msg)
-        return False
-    
     # Determine the path to the activated Python interpreter
     if platform.system() == 'Windows':
         python_path = os.path.join(venv_path, 'Scripts', 'python.exe')
@@ -151,16 +233,54 @@ def setup_venv():
         python_path = os.path.join(venv_path, 'bin', 'python')
         activate_path = os.path.join('.', 'venv', 'bin', 'activate')
     
-    # Install requirements
-    if not install_requirements(python_path):
-        return False
-    
-    return activate_path
+    prefetch = None
+    try:
+        # Reuse an existing venv built for this Python version unless asked to rebuild it
+        if not force and get_venv_python_version(python_path) == python_version:
+            print_color(f"♻️ Reusing existing virtual environment at {venv_path}", Fore.YELLOW)
+        else:
+            # Download the wheels while apt and venv creation run
+            prefetch = WheelPrefetch()
+            
+            # Remove existing venv if it exists
+            if os.path.exists(venv_path):
+                print_color(f"Removing existing virtual environment at {venv_path}", Fore.YELLOW)
+                shutil.rmtree(venv_path)
+                print_color("✅ Existing virtual environment removed.", Fore.GREEN)
+            
+            if not is_venv_installed():
+                print_color("python3-venv is not installed. Attempting to install it...", Fore.YELLOW)
+                if not install_python_venv(python_version):
+                    print_color("Failed to install python3-venv. Please install it manually and run this script again.", Fore.RED)
+                    return False
+            
+            try:
+                venv.create(venv_path, with_pip=True)
+                print_color(f"✅ Virtual environment created at {venv_path}", Fore.GREEN)
+            except subprocess.CalledProcessError as e:
+                error_msg = f"❌ Virtual environment creation failed: {str(e)}"
+                print_color(error_msg, Fore.RED)
+                logging.error(error_msg)
+                return False
+        
+        # Install requirements
+        if not install_requirements(python_path, prefetch=prefetch):
+            return False
+        
+        return activate_path
+    finally:
+        if prefetch is not None:
+            prefetch.stop()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Set up the environment for exploring LLMs.")
+    parser.add_argument('--force', action='store_true',
+                        help="recreate the virtual environment even if a usable one exists")
+    args = parser.parse_args()
+
     try:
         create_env_file()
-        activate_path = setup_venv()
+        activate_path = setup_venv(force=args.force)
         if activate_path:
             print_color("🚀 Setup complete! You're ready to start exploring LLMs!", Fore.GREEN)
             print_color("\nTo activate the virtual environment:", Fore.LIGHTYELLOW_EX)
@@ -173,8 +293,4 @@ if __name__ == "__main__":
     except Exception as e:
         print_color(f"⚠️ An error occurred during setup: {str(e)}", Fore.RED)
         print_color("Check the 'setup_log.txt' file for detailed error information.", Fore.YELLOW)
-        logging.error(f"Error details:\n{traceback.format_exc()}")
-        
-        # Write log to file
-        with open('setup_log.txt', 'w') as log_file:
-            log_file.write(log_stream.getvalue())
\ No newline at end of file
+        logging.error(f"Error details:\n{traceback.format_exc()}")
\ No newline at end of file